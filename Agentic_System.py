@@ -3,141 +3,190 @@ from phi.tools.sql import SQLTools
 from phi.model.google import Gemini
 from dotenv import load_dotenv
 import os
-import PyPDF2
+import pymupdf
 import tempfile
 from typing import Optional, List, Dict, Any
-from chromadb import Client, Settings
-from chromadb.utils import embedding_functions
+from chromadb import PersistentClient, Settings
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
 import logging
+import functools
+import re
+import threading
 
 load_dotenv()
 
 os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
 
+# Shared Gemini model so every agent reuses one client
+_GEMINI_FLASH = Gemini(model="gemini-1.5-flash")
+
 logger = logging.getLogger(__name__)
 
-# Base agent class
-class BaseAgent(Agent):
-    def __init__(self, name, model, tools=None, description=None, instructions=None, show_tool_calls=False, debug_mode=False):
-        super().__init__(
-            name=name, 
-            model=model,
-            tools=tools,
-            description=description,
-            instructions=instructions,
-            show_tool_calls=show_tool_calls,
-            debug_mode=debug_mode
-        )
+# Shared ChromaDB client so the store is opened once for all agents
+_CHROMA = PersistentClient(
+    path="./chroma_db",
+    settings=Settings(anonymized_telemetry=False)  # Disable telemetry to improve performance
+)
+
+class Int8MiniLM(ONNXMiniLM_L6_V2):
+    """MiniLM-L6-v2 embedding function running a dynamically int8-quantized copy of Chroma's ONNX model"""
+    QUANTIZED_MODEL_FILENAME = "model_int8.onnx"
+    # Builds the quantized session exactly once even when the first embeddings run in several worker
+    # threads, independent of whether functools.cached_property locks (it stopped doing so in Python 3.12)
+    _MODEL_LOCK = threading.Lock()
+
+    @functools.cached_property
+    def model(self):
+        model_dir = os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME)
+        quantized_path = os.path.join(model_dir, self.QUANTIZED_MODEL_FILENAME)
+        try:
+            with self._MODEL_LOCK:
+                if not os.path.exists(quantized_path):
+                    from onnxruntime.quantization import QuantType, quantize_dynamic
+                    
+                    # Quantize to a uniquely named temporary file first so a partial model is never picked up,
+                    # even when several worker processes build it at the same time
+                    fd, tmp_path = tempfile.mkstemp(suffix=".onnx.tmp", dir=model_dir)
+                    os.close(fd)
+                    try:
+                        quantize_dynamic(
+                            os.path.join(model_dir, "model.onnx"),
+                            tmp_path,
+                            weight_type=QuantType.QInt8
+                        )
+                        os.replace(tmp_path, quantized_path)
+                    finally:
+                        if os.path.exists(tmp_path):
+                            os.unlink(tmp_path)
+            
+            so = self.ort.SessionOptions()
+            so.log_severity_level = 3
+            return self.ort.InferenceSession(
+                quantized_path,
+                providers=["CPUExecutionProvider"],
+                sess_options=so
+            )
+        except Exception as e:
+            logger.warning("Falling back to the FP32 embedding model: %s", e)
+            return ONNXMiniLM_L6_V2.model.func(self)
+
+# Shared embedding function so the ONNX model is loaded once for all agents
+_EMBED_FN = Int8MiniLM()
 
-    def print_response(self, message):
-        return super().print_response(message)
+@functools.lru_cache(maxsize=256)
+def _embed_query(query_text):
+    """Embed a query once and reuse the vector for repeated queries"""
+    return tuple(float(x) for x in _EMBED_FN([query_text])[0])
 
 # PDF Processing Agent
-class PDFProcessingAgent(BaseAgent):
+class PDFProcessingAgent(Agent):
     def __init__(self, name="pdf_processor", model=None):
-        model = model or Gemini(model="gemini-1.5-flash")
-        super().__init__(name, model)
+        model = model or _GEMINI_FLASH
+        super().__init__(name=name, model=model)
         
-        # Initialize ChromaDB client with timeout settings
-        self.client = Client(Settings(
-            persist_directory="./chroma_db",
-            anonymized_telemetry=False  # Disable telemetry to improve performance
-        ))
+        self.client = _CHROMA
         
         # Create or get collection
         try:
             self.collection = self.client.get_or_create_collection(
                 name="resume_collection",
-                embedding_function=embedding_functions.DefaultEmbeddingFunction()
+                embedding_function=_EMBED_FN,
+                # Small HNSW graph settings sized for a handful of resumes per user
+                metadata={
+                    "hnsw:space": "cosine",
+                    "hnsw:construction_ef": 40,
+                    "hnsw:search_ef": 20,
+                    "hnsw:M": 8
+                }
             )
         except Exception as e:
-            logger.error(f"Error initializing ChromaDB collection: {e}")
+            logger.error("Error initializing ChromaDB collection: %s", e)
             # Create a fallback collection with minimal settings
             self.collection = self.client.get_or_create_collection(
                 name="resume_collection_fallback"
             )
 
     def process_pdf(self, file_path):
-        """Process a single PDF file and store its chunks in the vector database"""
+        """Process a single PDF file and store its text in the vector database"""
+        return self._process_pdf(os.path.basename(file_path), filename=file_path)
+
+    def process_pdf_bytes(self, data, filename):
+        """Process a PDF held in memory and store its text in the vector database"""
+        return self._process_pdf(filename, stream=data, filetype="pdf")
+
+    def _process_pdf(self, name, **open_args):
+        """Extract the text of a PDF opened with pymupdf.open(**open_args) and store it under name"""
         try:
-            with open(file_path, "rb") as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                filename = os.path.basename(file_path)
+            with pymupdf.open(**open_args) as pdf_doc:
+                # The summary agent only uses the first 10K chars, so stop reading pages once we have them
+                max_chars = 10000
                 
-                all_text = ""
-                for page_num, page in enumerate(pdf_reader.pages):
-                    text = page.extract_text()
-                    all_text += text
+                page_texts = []
+                text_length = 0
+                for page in pdf_doc:
+                    text = page.get_text("text")
+                    page_texts.append(text)
+                    text_length += len(text)
+                    if text_length >= max_chars:
+                        break
+                all_text = "".join(page_texts)
                 
-                # Create fewer, larger chunks to reduce processing time
-                chunk_size = 2000  # Increase chunk size
-                chunks = [all_text[i:i+chunk_size] for i in range(0, len(all_text), chunk_size)]
+                # Store the capped text as one document
+                resume_text = all_text[:max_chars]
                 
-                # Limit number of chunks to process
-                max_chunks = 5
-                if len(chunks) > max_chunks:
-                    logger.warning(f"Limiting processing to {max_chunks} chunks out of {len(chunks)}")
-                    chunks = chunks[:max_chunks]
+                # Scanned or image-only PDFs have no text layer, so there is nothing to summarize
+                if not resume_text.strip():
+                    logger.warning("No text found in %s", name)
+                    return {
+                        "status": "error",
+                        "message": f"No text found in {name}"
+                    }
                 
-                # Clear previous entries for this file if they exist
+                # Upsert by name so reprocessing replaces the previous entry in place
                 try:
-                    self.collection.delete(where={"filename": filename})
-                except Exception as e:
-                    logger.warning(f"Error clearing previous entries: {e}")
-                
-                # Add chunks to collection with timeout handling
-                added_chunks = 0
-                for chunk_id, chunk_text in enumerate(chunks):
-                    try:
-                        # Set a timeout for this operation
-                        self.collection.add(
-                            documents=[chunk_text],
-                            ids=[f"{filename}_{chunk_id}"],
-                            metadatas=[{"filename": filename, "page": 0, "chunk": chunk_id}]
-                        )
-                        added_chunks += 1
-                    except Exception as e:
-                        logger.error(f"Error adding chunk {chunk_id}: {e}")
-                        # Continue with next chunk
-                        continue
-                
-                if added_chunks > 0:
+                    self.collection.upsert(
+                        documents=[resume_text],
+                        ids=[name],
+                        metadatas=[{"filename": name}]
+                    )
                     return {
                         "status": "success",
-                        "message": f"Processed {filename} with {added_chunks} chunks",
-                        "chunks": added_chunks
+                        "message": f"Processed {name}",
+                        "filename": name
                     }
-                else:
-                    # If no chunks were added, return the extracted text directly
+                except Exception as e:
+                    logger.error("Error adding document to collection: %s", e)
+                    # If the document could not be stored, return the extracted text directly
                     return {
                         "status": "partial_success",
-                        "message": f"Failed to add chunks to database, but extracted text",
-                        "text": all_text[:10000]  # Return first 10K chars of text
+                        "message": f"Failed to add document to database, but extracted text",
+                        "text": resume_text
                     }
                 
         except Exception as e:
-            logger.error(f"Error processing PDF: {e}")
+            logger.error("Error processing PDF: %s", e)
             return {
                 "status": "error",
                 "message": f"Error processing PDF: {e}"
             }
 
-    def query_collection(self, query_text, n_results=3):
-        """Query the collection for relevant chunks based on the query text"""
+    def query_collection(self, query_text, n_results=3, filename=None):
+        """Query the collection for relevant documents, optionally restricted to one file"""
         try:
             results = self.collection.query(
-                query_texts=[query_text],
-                n_results=n_results
+                query_embeddings=[list(_embed_query(query_text))],
+                n_results=n_results,
+                where={"filename": filename} if filename else None
             )
             return results
         except Exception as e:
-            logger.error(f"Error querying collection: {e}")
+            logger.error("Error querying collection: %s", e)
             return {"documents": [[]], "metadatas": [[]], "distances": [[]]}
 
 # Summary Agent
-class SummaryAgent(BaseAgent):
+class SummaryAgent(Agent):
     def __init__(self, name="summary_agent", model=None):
-        model = model or Gemini(model="gemini-1.5-flash")
+        model = model or _GEMINI_FLASH
         super().__init__(
             name=name, 
             model=model,
@@ -146,28 +195,50 @@ class SummaryAgent(BaseAgent):
                 """
                 You are an expert at creating personalized job application emails.
                 
+                Each request contains the JOB POSITION, the RECIPIENT and the RESUME CONTENT.
+                
                 Your task is to:
                 1. Analyze the provided resume content
                 2. Extract key skills, experiences, and qualifications
                 3. Generate a professional and personalized email that highlights the candidate's strengths
-                4. Ensure the email is tailored to the job position mentioned in the subject
+                4. Ensure the email is tailored to the job position
                 5. Keep the tone professional but personable
                 
-                Important guidelines:
+                Create a professional email with this structure:
+                1. Start with a polite greeting (e.g., Dear Hiring Manager)
+                2. Open with excitement about applying for the position and eagerness to contribute technical skills
+                3. Mention current education status and any relevant work experience
+                4. Highlight key skills and expertise, using emojis for section headers:
+                   - ALWAYS use emojis (not bold text) for section headers: 💻, 🔧, 🛠️
+                   - For "Programming Languages" section, use 💻 emoji
+                   - For "Frameworks" section, use 🔧 emoji
+                   - For "Tools & Technologies" section, use 🛠️ emoji
+                   - List skills horizontally with commas (not as bullet points)
+                5. Briefly mention 3-4 project highlights with a one-line description each, using bullet points (*)
+                6. Express motivation to apply skills to the company and align with their goals
+                7. Politely invite the recruiter to review the attached resume
+                8. End with a professional closing and signature (including name, email, phone)
+                9. If a LinkedIn profile is mentioned in the resume, include it ONCE in the signature
+                
+                IMPORTANT RULES:
                 - Focus on the most relevant experiences for the position
-                - Highlight technical skills and achievements
                 - Keep the email concise (250-350 words)
-                - Include a polite closing and call to action
-                - Maintain a professional tone throughout
                 - DO NOT include placeholders like [Company Name] in the final output
                 - DO NOT include the subject line in the email body
                 - DO NOT include instructions or notes in the final output
+                - Keep the tone professional, friendly, and slightly enthusiastic
+                - Make the email clear and structured
+                - Focus on showcasing technical strength and readiness to contribute value
+                - ALWAYS use emojis (💻, 🔧, 🛠️) for section headers, never use bold text
+                - List skills horizontally separated by commas, not as bullet points
+                - Format only the project highlights as bullet points using asterisks (*)
+                - Include LinkedIn URL in signature ONLY ONCE if found in resume
                 """
             ]
         )
 
     def generate_email_content(self, resume_chunks, job_subject, recipient_email=None):
-        """Generate personalized email content based on resume chunks and job subject"""
+        """Generate personalized email content based on resume chunks and job subject, or None on failure"""
         try:
             # Extract job position from subject if possible
             job_position = job_subject
@@ -182,248 +253,21 @@ class SummaryAgent(BaseAgent):
             if len(resume_text) > 10000:
                 resume_text = resume_text[:10000] + "..."
             
-            # Create prompt with resume chunks and job position
-            prompt = f"""
-            Based on the following resume content, create a personalized job application email for a {job_position} position.
-            
-            RESUME CONTENT:
-            {resume_text}
-            
-            JOB POSITION: {job_position}
-            
-            RECIPIENT: {recipient_email if recipient_email else 'Hiring Manager'}
-            
-            Create a professional email with this structure:
-            1. Start with a polite greeting (e.g., Dear Hiring Manager)
-            2. Open with excitement about applying for the position and eagerness to contribute technical skills
-            3. Mention current education status and any relevant work experience
-            4. Highlight key skills and expertise, using emojis for section headers:
-               - ALWAYS use emojis (not bold text) for section headers: 💻, 🔧, 🛠️
-               - For "Programming Languages" section, use 💻 emoji
-               - For "Frameworks" section, use 🔧 emoji
-               - For "Tools & Technologies" section, use 🛠️ emoji
-               - List skills horizontally with commas (not as bullet points)
-            5. Briefly mention 3-4 project highlights with a one-line description each, using bullet points (*)
-            6. Express motivation to apply skills to the company and align with their goals
-            7. Politely invite the recruiter to review the attached resume
-            8. End with a professional closing and signature (including name, email, phone)
-            9. If a LinkedIn profile is mentioned in the resume, include it ONCE in the signature
-            
-            IMPORTANT RULES:
-            - DO NOT include placeholders like [Company Name] in the final output
-            - DO NOT include the subject line in the email body
-            - DO NOT include instructions or notes in the final output
-            - Keep the tone professional, friendly, and slightly enthusiastic
-            - Make the email clear and structured
-            - Focus on showcasing technical strength and readiness to contribute value
-            - ALWAYS use emojis (💻, 🔧, 🛠️) for section headers, never use bold text
-            - List skills horizontally separated by commas, not as bullet points
-            - Format only the project highlights as bullet points using asterisks (*)
-            - Include LinkedIn URL in signature ONLY ONCE if found in resume
-            """
+            # Keep the static instructions in the system prompt so they form a cacheable prefix,
+            # with the per-request resume content last
+            prompt = (
+                f"JOB POSITION: {job_position}\n"
+                f"RECIPIENT: {recipient_email if recipient_email else 'Hiring Manager'}\n\n"
+                f"RESUME CONTENT:\n{resume_text}"
+            )
             
             response = self.run(prompt, markdown=True)
-            return response.content
+            return response.content or None
         except Exception as e:
-            logger.error(f"Error generating email content: {e}")
-            return """Dear Hiring Manager,
-
-I am excited to apply for the position mentioned in the subject line. Please find my resume attached for your consideration.
-
-Best regards,
-Zain Raza
-Lahore, Pakistan
-📧 zainxaidi2003@gmail.com | 📞 0306-5187343"""
-
-# Existing agents
-class SQLAgent:
-    def __init__(self):
-        """
-        Initializes an SQLAgent to generate SQL queries to check if a user exists in the database.
-        """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
-            description="This agent generates SQL queries to check if a user exists in the database.",
-            instructions=[
-                """
-                Database Schema Details:
-                -------------------------
-                Table: 'users'
-                Columns:
-                - id (bigint unsigned, PRIMARY KEY)
-                - name (varchar)
-                - phone (varchar)
-                - email (varchar)
-                - is_member (tinyint(1), represents boolean)
-                - is_deleted (tinyint(1), represents boolean)
-                
-                Your task:
-                Generate an SQL query using the above schema. Ensure the query is syntactically correct and adheres to the schema constraints. 
-                The query should retrieve user details based on the provided phone number, ensuring the account is not marked as deleted.
-                """
-            ]
-        )
-    
-    def generate_query(self, phone_number: str) -> str:
-        """
-        Generates an SQL query to check if a user exists in the database.
-
-        Parameters:
-        phone_number (str): The phone number to check.
-
-        Returns:
-        str: SQL query to check if the user exists.
-        """
-        query_prompt = f"""
-        Generate an SQL query to check if a user with phone number {phone_number} exists in the users table.
-        The query should:
-        1. Return the user's id, name, phone, and is_member status
-        2. Filter where phone = '{phone_number}' and is_deleted = 0
-        
-        Return only the SQL query without any explanation or markdown formatting.
-        """
-        
-        response = self.agent.run(query_prompt, markdown=True)
-        return response.content
-
-class ChatAgent:
-    def __init__(self):
-        """
-        Initializes a ChatAgent to manage chat sessions and generate queries related to chat functionality.
-        """
-        self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
-            description="This agent manages chat sessions and generates queries related to chat functionality.",
-            instructions=[
-                """
-                Database Schema Details:
-                -------------------------
-                Table: 'chats'
-                Columns:
-                - id (bigint unsigned, PRIMARY KEY)
-                - user_id (bigint unsigned, links to users.id)
-                - status (varchar, can be 'active' or 'ended')
-                - created_at (timestamp)
-                - updated_at (timestamp)
-                
-                Table: 'messages'
-                Columns:
-                - id (bigint unsigned, PRIMARY KEY)
-                - chat_id (bigint unsigned, links to chats.id)
-                - user_id (bigint unsigned, links to users.id)
-                - user_message (text)
-                - bot_reply (text)
-                - created_at (timestamp)
-                
-                Important: We are using SQLite database, so use CURRENT_TIMESTAMP instead of NOW() for datetime functions.
-                
-                Your task:
-                Generate SQL queries to manage chat sessions and messages.
-                """
-            ]
-        )
-    
-    def check_active_chat(self, user_id: str) -> str:
-        """
-        Generates an SQL query to check if a user has an active chat.
-
-        Parameters:
-        user_id (str): The user ID to check.
-
-        Returns:
-        str: SQL query to check for active chats.
-        """
-        query_prompt = f"""
-        Generate an SQL query to check if user with ID {user_id} has an active chat.
-        The query should:
-        1. Return the chat id, user_id, and status
-        2. Filter where user_id = {user_id} and status = 'active'
-        3. Order by created_at DESC
-        4. Limit to 1 result (most recent active chat)
-        
-        Return only the SQL query without any explanation or markdown formatting.
-        """
-        
-        response = self.agent.run(query_prompt, markdown=True)
-        return response.content
-    
-    def create_new_chat(self, user_id: str) -> str:
-        """
-        Generates an SQL query to create a new active chat for a user.
-
-        Parameters:
-        user_id (str): The user ID to create a chat for.
-
-        Returns:
-        str: SQL query to create a new chat.
-        """
-        query_prompt = f"""
-        Generate an SQL query to create a new active chat for user with ID {user_id}.
-        The query should:
-        1. Insert into the chats table
-        2. Set user_id = {user_id}, status = 'active', and appropriate timestamps
-        
-        Return only the SQL query without any explanation or markdown formatting.
-        """
-        
-        response = self.agent.run(query_prompt, markdown=True)
-        return response.content
-    
-    def get_chat_messages(self, chat_id: str) -> str:
-        """
-        Generates an SQL query to retrieve all messages for a specific chat.
-        
-        Parameters:
-        chat_id (str): The chat ID to retrieve messages for.
-        
-        Returns:
-        str: SQL query to retrieve chat messages.
-        """
-        query_prompt = f"""
-        Generate an SQL query to retrieve all messages for chat with ID {chat_id}.
-        The query should:
-        1. Return the user_message and bot_reply
-        2. Filter where chat_id = {chat_id}
-        3. Order by created_at ASC (oldest to newest)
-        
-        Return only the SQL query without any explanation or markdown formatting.
-        """
-        
-        response = self.agent.run(query_prompt, markdown=True)
-        return response.content
+            logger.error("Error generating email content: %s", e)
+            return None
 
-    def save_message(self, chat_id: int, user_id: int, user_message: str, bot_reply: str) -> str:
-        """
-        Generate a query to save a message in the database.
-        """
-        query = f"""
-        INSERT INTO messages (chat_id, user_id, user_message, bot_reply, created_at)
-        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        """
-        return {"query": query, "params": [chat_id, user_id, user_message, bot_reply]}
-
-    def end_chat(self, chat_id: str) -> str:
-        """
-        Generates an SQL query to end a chat session.
-        
-        Parameters:
-        chat_id (str): The chat ID to end.
-        
-        Returns:
-        str: SQL query to end a chat.
-        """
-        query_prompt = f"""
-        Generate an SQL query to end a chat session.
-        The query should:
-        1. Update the chats table
-        2. Set status = 'ended' and update the updated_at timestamp
-        3. Where id = {chat_id}
-        
-        Return only the SQL query without any explanation or markdown formatting.
-        """
-        
-        response = self.agent.run(query_prompt, markdown=True)
-        return response.content
+INTRO_CACHE_SIZE = 1024
 
 class IntroAgent:
     def __init__(self):
@@ -431,7 +275,7 @@ class IntroAgent:
         Initializes an IntroAgent to handle the initial conversation with users.
         """
         self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+            model=_GEMINI_FLASH,
             description="This agent handles the initial conversation with users for the email assistant.",
             instructions=[
                 """
@@ -451,6 +295,8 @@ class IntroAgent:
                 """
             ]
         )
+        # The intro only depends on the user's name, so successful replies are reused per name
+        self._intros = {}
     
     def generate_intro_message(self, user_data: Dict[str, Any], user_message: str) -> str:
         """
@@ -463,10 +309,23 @@ class IntroAgent:
         Returns:
         str: The introductory message.
         """
+        name = user_data.get("name", "guest")
+        intro = self._intros.get(name)
+        if intro is None:
+            intro = self._generate_intro(name)
+            # Empty or failed replies are not cached, so the next message tries again
+            if intro:
+                if len(self._intros) >= INTRO_CACHE_SIZE:
+                    self._intros.pop(next(iter(self._intros)))
+                self._intros[name] = intro
+        return intro
+
+    def _generate_intro(self, name: str) -> str:
+        """
+        Generate the introductory message for a user name.
+        """
         prompt = f"""
-        User: {user_message}
-        
-        User Data: {user_data}
+        User Name: {name}
         
         Generate an introductory message for the user. The message should:
         1. Greet the user by name
@@ -481,13 +340,45 @@ class IntroAgent:
         response = self.agent.run(prompt, markdown=True)
         return response.content
 
+# Patterns used by the MediatorAgent to find the recipient and subject in user messages
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# A subject needs an explicit "subject:" style marker and ends at a comma, at the end of the line,
+# where the recipient's address follows, or at a sentence end followed by a capitalized word;
+# unmarked subjects are left to the LLM
+_SUBJECT_ABBREVIATIONS = (
+    "Sr", "Jr", "Snr", "Jnr", "Mr", "Mrs", "Ms", "Dr", "Prof", "St",
+    "Inc", "Ltd", "Co", "Corp", "Dept", "No", "vs", "etc", "e.g", "i.e"
+)
+_SUBJECT_RE = re.compile(
+    r"\bsubject(?:\s+(?:is|line))?\s*(?::|=|\s-\s)\s*[\"']?"
+    r"(.+?)"
+    r"(?=[\"']?\s*(?:$|[,;\n]|(?:(?:to|email|at)\s+)?[\w.+-]+@)"
+    r"|" + "".join(rf"(?<!\b{re.escape(abbr)})" for abbr in _SUBJECT_ABBREVIATIONS) +
+    r"[\"']?[.!?][\"']?(?:[ \t]*$|\s+(?-i:[A-Z])))",
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Earlier messages are re-scanned on every webhook, so results are cached per message text
+@functools.lru_cache(maxsize=1024)
+def _find_email(text):
+    """Return the first email address in the text, or None"""
+    email_match = _EMAIL_RE.search(text)
+    return email_match.group(0).rstrip(".") if email_match else None
+
+@functools.lru_cache(maxsize=1024)
+def _find_subject(text):
+    """Return the subject given in the text, or None"""
+    subject_match = _SUBJECT_RE.search(text)
+    return (subject_match.group(1).strip() or None) if subject_match else None
+
 class MediatorAgent:
-    def __init__(self):
+    def __init__(self, model=None):
         """
         Initializes a MediatorAgent to analyze conversation and determine next steps.
         """
+        # Only consulted when pattern matching finds an email address but no marked subject
         self.agent = Agent(
-            model=Gemini(model="gemini-1.5-flash"),
+            model=model or _GEMINI_FLASH,
             description="This agent analyzes the conversation and determines the next steps.",
             instructions=[
                 """
@@ -515,7 +406,40 @@ class MediatorAgent:
     def analyze_conversation(self, user_data: Dict[str, Any], chat_history: List[Dict[str, Any]], user_message: str, media_urls: List[str]) -> str:
         """
         Analyze the conversation and determine the next steps.
+        
+        Returns "TRUE, [email], [subject], [attachment_url]" when everything is present,
+        "FALSE_1" when only the attachment is missing and "FALSE_2" otherwise.
         """
+        # Only user messages are scanned, newest first, since bot replies contain example addresses
+        user_messages = [user_message or ""]
+        user_messages.extend(msg.get("user_message") or "" for msg in reversed(chat_history))
+        
+        email = None
+        subject = None
+        for text in user_messages:
+            if email is None:
+                email = _find_email(text)
+            if subject is None:
+                subject = _find_subject(text)
+            if email and subject:
+                break
+        
+        if email and subject:
+            result = f"TRUE, {email}, {subject}, {media_urls[0] if media_urls else ''}"
+        elif email:
+            # The subject may be given without a "subject:" marker, which needs the LLM to pick out
+            result = self._ask_agent(user_data, chat_history[-4:], user_message, media_urls)
+        else:
+            return "FALSE_2"
+        
+        if result.startswith("TRUE") and not media_urls:
+            # Force FALSE_1 if no attachments
+            return "FALSE_1"
+            
+        return result
+    
+    def _ask_agent(self, user_data, chat_history, user_message, media_urls):
+        """Let the LLM decide on the conversation, returning "FALSE_2" if it fails"""
         chat_messages = []
         for msg in chat_history:
             chat_messages.append(f"User: {msg['user_message']}")
@@ -540,19 +464,14 @@ class MediatorAgent:
             "Format responses EXACTLY as specified. Do not add extra text."
         )
         
-        response = self.agent.run(prompt, markdown=True)
-        result = response.content.strip()
-
-    
-        if result.startswith("TRUE") and not media_urls:
-            # Force FALSE_1 if no attachments
-            return "FALSE_1"
-            
-        return result
+        try:
+            response = self.agent.run(prompt, markdown=True)
+            return response.content.strip()
+        except Exception as e:
+            logger.error("Error analyzing conversation: %s", e)
+            return "FALSE_2"
 
 # Initialize agents
-sql_agent = SQLAgent()
-chat_agent = ChatAgent()
 intro_agent = IntroAgent()
 mediator_agent = MediatorAgent()
 pdf_agent = PDFProcessingAgent()
@@ -1,27 +1,31 @@
-from fastapi import FastAPI, Request, Response, Form
+from fastapi import FastAPI, Request, Response, Form, BackgroundTasks
 from twilio.rest import Client
 from twilio.request_validator import RequestValidator
+from twilio.twiml.messaging_response import MessagingResponse
 from dotenv import load_dotenv
 import os
 import logging
+import asyncio
 from typing import Optional, List
 import json
-import requests
+import httpx
 import tempfile
 import re
-from Agentic_System import sql_agent, chat_agent, intro_agent, mediator_agent, pdf_agent, summary_agent
-from db import execute_query, init_db
-from email_agent import EmailToolsWithAttachments, Agent, Gemini
+import hashlib
+from collections import OrderedDict
+from Agentic_System import intro_agent, mediator_agent, pdf_agent, summary_agent
+from db import init_db, get_user_by_phone, get_active_chat, create_chat, end_chat, save_message, get_chat_messages
+from email_agent import EmailToolsWithAttachments
 from datetime import datetime
 
+load_dotenv()
+
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 app = FastAPI()
 
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -32,25 +36,46 @@ TWILIO_WHATSAPP_NUMBER = "whatsapp:+14155238886"
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 validator = RequestValidator(TWILIO_AUTH_TOKEN)
 
+# Shared async HTTP client for downloading Twilio media, reusing keep-alive connections
+http_client = httpx.AsyncClient(
+    auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+    headers={"User-Agent": "zmail-bot/1.0"},
+    timeout=30,
+    follow_redirects=True
+)
+
+EMAIL_TOOL = EmailToolsWithAttachments(
+    sender_email=os.getenv("SENDER_EMAIL", "zainxaidi2003@gmail.com"),
+    sender_name=os.getenv("SENDER_NAME", "Zain Raza"),
+    sender_passkey=os.getenv("SENDER_PASSKEY", "fvft xjpw pdoz onlk"),
+)
+
 MOCK_MODE = False
 
+# Twilio waits 15 seconds for a webhook response, so replies taking longer are sent separately
+TWIML_REPLY_TIMEOUT = 10
+
 async def verify_twilio_request(request: Request) -> bool:
     try:
         url = str(request.url)
         form_data = await request.form()
         signature = request.headers.get("X-Twilio-Signature", "")
         
-        logger.debug(f"Validating request - URL: {url}")
-        logger.debug(f"Form data: {form_data}")
-        logger.debug(f"Twilio signature: {signature}")
+        logger.debug("Validating request - URL: %s", url)
+        logger.debug("Form data: %s", form_data)
+        logger.debug("Twilio signature: %s", signature)
         
         is_valid = validator.validate(url, form_data, signature)
-        logger.debug(f"Request validation result: {is_valid}")
+        logger.debug("Request validation result: %s", is_valid)
         return is_valid
     except Exception as e:
-        logger.error(f"Error validating request: {e}", exc_info=True)
+        logger.error("Error validating request: %s", e, exc_info=True)
         return False
 
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
 @app.get("/")
 async def root():
     logger.info("Root endpoint hit")
@@ -58,117 +83,143 @@ async def root():
 
 init_db()
 
-def send_whatsapp_message(body, to_number):
-    """Send WhatsApp message with mock mode support"""
+def _mock_send(body, to_number):
+    """Log a WhatsApp message instead of sending it"""
+    logger.info("MOCK MODE: Would send message to %s: %s", to_number, body)
+    return {"sid": "MOCK_SID_" + str(hash(body))[:8]}
+
+def _real_send(body, to_number):
+    """Send a WhatsApp message through the Twilio REST API"""
     try:
-        if MOCK_MODE:
-            logger.info(f"MOCK MODE: Would send message to {to_number}: {body}")
-            return {"sid": "MOCK_SID_" + str(hash(body))[:8]}
-        else:
-            response = twilio_client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                body=body,
-                to=to_number
-            )
-            return response
+        return twilio_client.messages.create(from_=TWILIO_WHATSAPP_NUMBER, body=body, to=to_number)
     except Exception as e:
-        logger.error(f"Error sending message: {e}")
+        logger.error("Error sending message: %s", e)
         return {"sid": "ERROR_SID", "error": str(e)}
 
-def download_file(url, local_path):
-    """Download a file from a URL to a local path with Twilio authentication"""
-    try:
+# MOCK_MODE never changes at runtime, so the sender is picked once
+send_whatsapp_message = _mock_send if MOCK_MODE else _real_send
 
-        auth = (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        logger.info(f"Attempting to download file from: {url}")
-        response = requests.get(url, auth=auth)
+async def download_file(url):
+    """Download a file from a URL with Twilio authentication and return its contents, or None"""
+    try:
+        logger.info("Attempting to download file from: %s", url)
+        # Resumes are small, so the file is kept in memory rather than written to disk
+        response = await http_client.get(url)
         response.raise_for_status()
         
-        with open(local_path, 'wb') as f:
-            f.write(response.content)
-        
-        logger.info(f"File downloaded successfully to {local_path}")
-        return True
+        logger.info("File downloaded successfully (%s bytes)", len(response.content))
+        return response.content
     except Exception as e:
-        logger.error(f"Error downloading file: {e}")
-        return False
+        logger.error("Error downloading file: %s", e)
+        return None
 
-def send_email(recipient_email, subject, body, attachment_path=None):
-    """Send an email using the EmailToolsWithAttachments"""
+async def send_email(recipient_email, subject, body, attachment=None):
+    """Send an email using the EmailToolsWithAttachments, attaching an optional (file name, data) pair"""
     try:
-        
-        sender_email = os.getenv("SENDER_EMAIL", "zainxaidi2003@gmail.com")
-        sender_name = os.getenv("SENDER_NAME", "Zain Raza")
-        sender_passkey = os.getenv("SENDER_PASSKEY", "fvft xjpw pdoz onlk")
-        
-    
-        agent = Agent(
-            tools=[
-                EmailToolsWithAttachments(
-                    receiver_email=recipient_email,
-                    sender_email=sender_email,
-                    sender_name=sender_name,
-                    sender_passkey=sender_passkey,
-                )
-            ],
-            model=Gemini(model="gemini-1.5-flash")
+        result = await asyncio.to_thread(
+            EMAIL_TOOL.email_user_with_attachments,
+            subject,
+            body,
+            [attachment] if attachment else None,
+            receiver_email=recipient_email
         )
+        logger.info("Email sending result: %s", result)
         
-        if attachment_path:
-            command = f"send an email with a subject '{subject}' and body '{body}' with attachments ['{attachment_path}']"
-        else:
-            command = f"send an email with a subject '{subject}' and body '{body}'"
-        
-        response = agent.run(command, markdown=True)
-        logger.info(f"Email sending response: {response.content}")
-        
-        return "email sent successfully" in response.content
+        return result == "email sent successfully"
     except Exception as e:
-        logger.error(f"Error sending email: {e}", exc_info=True)
+        logger.error("Error sending email: %s", e, exc_info=True)
         return False
 
-def generate_email_body(subject, attachment_path=None, recipient_email=None):
-    """Generate an email body based on the resume and subject"""
+# LRU caches keyed by the resume's content hash, so one CV sent to many recipients is processed once
+PDF_CACHE_SIZE = 128
+_PDF_CACHE = OrderedDict()  # pdf hash -> resume chunks
+_EMAIL_BODY_CACHE = OrderedDict()  # (pdf hash, subject, recipient) -> email body
+
+def _cache_get(cache, key):
+    """Return a cached value and mark it as recently used, or None"""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _cache_put(cache, key, value):
+    """Store a value, evicting the least recently used entry when full"""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > PDF_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def _pdf_hash(data):
+    """Hash a file's contents"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+async def extract_resume_chunks(subject, pdf_data, pdf_hash):
+    """Process the PDF and return the resume text chunks for the summary agent, or None"""
+    # Store the resume under its content hash, so concurrent uploads never share an id and
+    # re-sending the same CV replaces its entry instead of adding a new one
+    processing_result = await asyncio.to_thread(pdf_agent.process_pdf_bytes, pdf_data, pdf_hash)
+    logger.info("PDF processing result: %s", processing_result)
+    
+    # Handle different processing results
+    if processing_result.get("status") == "success":
+        # Query for the stored resume
+        query_text = f"job application for {subject}"
+        results = await asyncio.to_thread(
+            pdf_agent.query_collection,
+            query_text,
+            n_results=1,
+            filename=processing_result.get("filename")
+        )
+        
+        if results and results.get("documents") and results["documents"][0]:
+            return results["documents"][0]
+    elif processing_result.get("status") == "partial_success" and processing_result.get("text"):
+        # Use the extracted text directly with the summary agent
+        logger.info("Using extracted text directly with summary agent")
+        return [processing_result.get("text")]
+    
+    return None
+
+async def generate_email_body(subject, attachment=None, recipient_email=None):
+    """Generate an email body based on the resume, given as a (file name, data) pair, and subject"""
     try:
-        # If no attachment path is provided, return the default template
-        if not attachment_path:
-            logger.warning("No attachment path provided, using default email template")
+        # If no attachment is provided, return the default template
+        if not attachment:
+            logger.warning("No attachment provided, using default email template")
             return get_default_email_template(subject)
         
-        # Process the PDF
-        processing_result = pdf_agent.process_pdf(attachment_path)
-        logger.info(f"PDF processing result: {processing_result}")
+        pdf_hash = _pdf_hash(attachment[1])
+        body_key = (pdf_hash, subject, recipient_email)
+        email_content = _cache_get(_EMAIL_BODY_CACHE, body_key)
+        if email_content is not None:
+            logger.info("Using cached email body")
+            return email_content
         
-        # Handle different processing results
-        if processing_result.get("status") == "success":
-            # Query for relevant chunks
-            query_text = f"job application for {subject}"
-            results = pdf_agent.query_collection(query_text)
-            
-            if results and results.get("documents") and results["documents"][0]:
-                # Generate email content using the summary agent
-                email_content = summary_agent.generate_email_content(
-                    resume_chunks=results["documents"][0],
-                    job_subject=subject,
-                    recipient_email=recipient_email
-                )
-                return email_content
-        elif processing_result.get("status") == "partial_success" and processing_result.get("text"):
-            # Use the extracted text directly with the summary agent
-            logger.info("Using extracted text directly with summary agent")
-            email_content = summary_agent.generate_email_content(
-                resume_chunks=[processing_result.get("text")],
+        resume_chunks = _cache_get(_PDF_CACHE, pdf_hash)
+        if resume_chunks is None:
+            resume_chunks = await extract_resume_chunks(subject, attachment[1], pdf_hash)
+            if resume_chunks:
+                _cache_put(_PDF_CACHE, pdf_hash, resume_chunks)
+        else:
+            logger.info("Using cached resume content")
+        
+        if resume_chunks:
+            # Generate email content using the summary agent
+            email_content = await asyncio.to_thread(
+                summary_agent.generate_email_content,
+                resume_chunks=resume_chunks,
                 job_subject=subject,
                 recipient_email=recipient_email
             )
-            return email_content
+            if email_content:
+                _cache_put(_EMAIL_BODY_CACHE, body_key, email_content)
+                return email_content
         
-        # Fallback to default template if processing fails
-        logger.warning("Using default email template as PDF processing failed")
+        # Fallback to default template if processing or generation fails
+        logger.warning("Using default email template as the resume could not be summarized")
         return get_default_email_template(subject)
     except Exception as e:
-        logger.error(f"Error generating email body: {e}", exc_info=True)
+        logger.error("Error generating email body: %s", e, exc_info=True)
         # Return default template if there's an error
         return get_default_email_template(subject)
 
@@ -183,123 +234,84 @@ Zain Raza
 Lahore, Pakistan
 📧 zainxaidi2003@gmail.com | 📞 0306-5187343"""
 
-@app.post("/webhook/whatsapp")
-async def whatsapp_webhook(request: Request):
+async def reply_and_log(chat_id, user_id, user_message, bot_reply):
+    """Store the exchange in the chat history and return the reply to send"""
+    await asyncio.to_thread(save_message, chat_id, user_id, user_message, bot_reply)
+    return bot_reply
+
+async def process_whatsapp_message(form_dict):
     """
-    Webhook endpoint for WhatsApp messages - Email Assistant System
+    Process an incoming WhatsApp message and return the reply text, or None if there is no reply
     """
-    print('Webhook hit')
     try:
-        form_data = await request.form()
-        form_dict = dict(form_data)
-        logger.debug(f"Received WhatsApp webhook data: {form_dict}")
-
         from_number = form_dict.get("From", "")
         body = form_dict.get("Body", "")
         wa_id = form_dict.get("WaId", "")
         
         num_media = int(form_dict.get("NumMedia", "0"))
-        media_content_types = []
-        media_urls = []
+        # Only PDF attachments are used, anything else is ignored
+        media_urls = [
+            form_dict[f"MediaUrl{i}"] for i in range(num_media)
+            if form_dict.get(f"MediaContentType{i}", "").lower() == "application/pdf" and form_dict.get(f"MediaUrl{i}")
+        ]
         
-        for i in range(num_media):
-            media_content_type = form_dict.get(f"MediaContentType{i}")
-            media_url = form_dict.get(f"MediaUrl{i}")
-            
-            if media_content_type and media_url:
-
-                if media_content_type.lower() == 'application/pdf':
-                    media_content_types.append(media_content_type)
-                    media_urls.append(media_url)
-                    logger.info(f"Received PDF: {media_url}")
-                else:
-                    logger.warning(f"Received non-PDF media: {media_content_type}")
-        
-        logger.info(f"WhatsApp message received - From: {from_number}, Body: {body}, WaId: {wa_id}")
+        logger.info("WhatsApp message received - From: %s, Body: %s, WaId: %s, PDFs: %s/%s", from_number, body, wa_id, len(media_urls), num_media)
         
         if wa_id:
             try:
                 clean_number = from_number.replace("whatsapp:", "")
                 
-                sql_query = sql_agent.generate_query(clean_number)
-                logger.info(f"Generated SQL query for user check: {sql_query}")
-                
-                user_result = execute_query(sql_query)
-                logger.debug(f"User query result: {user_result}")
+                user_data = await asyncio.to_thread(get_user_by_phone, clean_number)
+                logger.debug("User query result: %s", user_data)
                 
-                if not user_result or not user_result[0].get("is_member", 0):
-                    logger.info(f"User not found or not a member: {clean_number}")
-                    response = twilio_client.messages.create(
-                        from_=TWILIO_WHATSAPP_NUMBER,
-                        body="You are not subscribed to our membership. Please contact zainxaidi2003@gmail.com for membership details.",
-                        to=from_number
-                    )
-                    logger.info(f"Non-member message sent with SID: {response.sid}")
-                    return Response(
-                        content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
-                        media_type="application/xml"
-                    )
+                if not user_data or not user_data.get("is_member", 0):
+                    logger.info("User not found or not a member: %s", clean_number)
+                    return "You are not subscribed to our membership. Please contact zainxaidi2003@gmail.com for membership details."
             
-                user_data = user_result[0]
                 user_id = user_data["id"]
                 
-                active_chat_query = chat_agent.check_active_chat(user_id)
-                logger.info(f"Generated SQL query for active chat: {active_chat_query}")
-                
-                active_chat_result = execute_query(active_chat_query)
+                active_chat = await asyncio.to_thread(get_active_chat, user_id)
                 
                 chat_id = None
                 chat_history = []
                 
-                if not active_chat_result:
-                    new_chat_query = chat_agent.create_new_chat(user_id)
-                    logger.info(f"Generated SQL query for new chat: {new_chat_query}")
-                    
-                    new_chat_result = execute_query(new_chat_query)
-                    if new_chat_result and "id" in new_chat_result:
-                        chat_id = new_chat_result["id"]
-                        logger.info(f"Created new chat with ID: {chat_id}")
+                if not active_chat:
+                    chat_id = await asyncio.to_thread(create_chat, user_id)
+                    if chat_id:
+                        logger.info("Created new chat with ID: %s", chat_id)
                         
 
-                        intro_message = intro_agent.generate_intro_message(user_data, body)
-                        logger.info(f"Generated intro message: {intro_message}")
-                        
+                        intro_message = await asyncio.to_thread(intro_agent.generate_intro_message, user_data, body)
+                        logger.info("Generated intro message: %s", intro_message)
                         
-                        save_message = chat_agent.save_message(chat_id, user_id, body, intro_message)
-                        execute_query(save_message["query"], save_message["params"])
                         
-                        response = twilio_client.messages.create(
-                            from_=TWILIO_WHATSAPP_NUMBER,
-                            body=intro_message,
-                            to=from_number
-                        )
-                        logger.info(f"Intro message sent with SID: {response.sid}")
+                        return await reply_and_log(chat_id, user_id, body, intro_message)
                     else:
-                        logger.error(f"Failed to create new chat: {new_chat_result}")
-                        response = twilio_client.messages.create(
-                            from_=TWILIO_WHATSAPP_NUMBER,
-                            body="Sorry, I encountered an error setting up your chat session. Please try again later.",
-                            to=from_number
-                        )
+                        logger.error("Failed to create new chat for user: %s", user_id)
+                        return "Sorry, I encountered an error setting up your chat session. Please try again later."
                 else:
-                    chat_id = active_chat_result[0]["id"]
-                    chat_history_query = chat_agent.get_chat_messages(chat_id)
-                    logger.info(f"Generated SQL query for chat history: {chat_history_query}")
-                    
-                    chat_history = execute_query(chat_history_query)
-                    logger.info(f"Retrieved chat history with {len(chat_history)} messages")
+                    chat_id = active_chat["id"]
+                    chat_history = await asyncio.to_thread(get_chat_messages, chat_id)
+                    logger.info("Retrieved chat history with %s messages", len(chat_history))
                     
-                    logger.debug("=== Conversation Analysis Debug ===")
-                    logger.debug(f"User Data: {user_data}")
-                    logger.debug(f"Chat History: {chat_history}")
-                    logger.debug(f"Current Message: {body}")
-                    logger.debug(f"Media URLs: {media_urls}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("=== Conversation Analysis Debug ===")
+                        logger.debug("User Data: %s", user_data)
+                        logger.debug("Chat History: %r", chat_history)
+                        logger.debug("Current Message: %s", body)
+                        logger.debug("Media URLs: %s", media_urls)
                     
         
-                    mediator_response = mediator_agent.analyze_conversation(
-                        user_data, chat_history, body, media_urls
+                    # Download the attachment while the conversation is analyzed, so it is ready if it's needed
+                    download_task = asyncio.create_task(download_file(media_urls[0])) if media_urls else None
+                    
+                    mediator_response = await asyncio.to_thread(
+                        mediator_agent.analyze_conversation, user_data, chat_history, body, media_urls
                     )
-                    logger.debug(f"Mediator Response: {mediator_response}")
+                    logger.debug("Mediator Response: %s", mediator_response)
+                    
+                    if download_task and not mediator_response.startswith("TRUE"):
+                        download_task.cancel()
                     
                     if mediator_response.startswith("TRUE"):
                         parts = mediator_response.split(",")
@@ -307,83 +319,44 @@ async def whatsapp_webhook(request: Request):
                         subject = parts[2].strip()
                         
                         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        temp_file = f"/tmp/resume_{timestamp}.pdf"
+                        filename = f"resume_{timestamp}.pdf"
                         
-                        logger.info(f"Attempting to download attachment to {temp_file}")
+                        pdf_data = await download_task if download_task else None
                         
-                        if media_urls and download_file(media_urls[0], temp_file):
+                        if pdf_data:
+                            attachment = (filename, pdf_data)
 
-                            email_body = generate_email_body(subject, temp_file, recipient_email)
-                            
+                            email_body = await generate_email_body(subject, attachment, recipient_email)
                             
-                            email_sent = send_email(recipient_email, subject, email_body, temp_file)
                             
-                            
-                            try:
-                                os.unlink(temp_file)
-                                logger.info(f"Cleaned up temporary file: {temp_file}")
-                            except Exception as e:
-                                logger.error(f"Error cleaning up file: {e}")
+                            email_sent = await send_email(recipient_email, subject, email_body, attachment)
                             
                         
-                            print('Email sent: ', email_sent)
-                            if email_sent == False:
+                            logger.info("Email sent: %s", email_sent)
+                            if email_sent:
                             
-                                end_chat_query = chat_agent.end_chat(chat_id)
-                                execute_query(end_chat_query)
+                                await asyncio.to_thread(end_chat, chat_id)
                                 
                         
                                 confirmation_message = f"✅ Email sent successfully to {recipient_email}!"
                                 
                             
-                                save_message = chat_agent.save_message(chat_id, user_id, body, confirmation_message)
-                                execute_query(save_message["query"], save_message["params"])
-                                
-        
-                                response = twilio_client.messages.create(
-                                    from_=TWILIO_WHATSAPP_NUMBER,
-                                    body=confirmation_message,
-                                    to=from_number
-                                )
-                                logger.info(f"Confirmation message sent with SID: {response.sid}")
+                                return await reply_and_log(chat_id, user_id, body, confirmation_message)
                             else:
                                 error_message = "❌ Sorry, I encountered an error sending the email. Please try again later."
                                 
                 
-                                save_message = chat_agent.save_message(chat_id, user_id, body, error_message)
-                                execute_query(save_message["query"], save_message["params"])
-                                
-                                response = twilio_client.messages.create(
-                                    from_=TWILIO_WHATSAPP_NUMBER,
-                                    body=error_message,
-                                    to=from_number
-                                )
+                                return await reply_and_log(chat_id, user_id, body, error_message)
                         else:
                             error_message = "❌ Sorry, I encountered an error downloading your attachment. Please try again."
                             
                     
-                            save_message = chat_agent.save_message(chat_id, user_id, body, error_message)
-                            execute_query(save_message["query"], save_message["params"])
-                            
-
-                            response = twilio_client.messages.create(
-                                from_=TWILIO_WHATSAPP_NUMBER,
-                                body=error_message,
-                                to=from_number
-                            )
+                            return await reply_and_log(chat_id, user_id, body, error_message)
                     elif mediator_response == "FALSE_1":
                         logger.info("Attachment missing, sending reminder")
                         missing_attachment_message = "📎 Please attach your resume/CV/transcript/experience letter to continue. I need this to send your job application."
                     
-                        save_message = chat_agent.save_message(chat_id, user_id, body, missing_attachment_message)
-                        execute_query(save_message["query"], save_message["params"])
-                        
-                        response = twilio_client.messages.create(
-                            from_=TWILIO_WHATSAPP_NUMBER,
-                            body=missing_attachment_message,
-                            to=from_number
-                        )
-                        logger.info(f"Reminder sent with SID: {response.sid}")
+                        return await reply_and_log(chat_id, user_id, body, missing_attachment_message)
                     elif mediator_response == "FALSE_2":
                 
                         missing_info_message = "📝 I need a bit more information to send your email:\n\n" + \
@@ -393,15 +366,7 @@ async def whatsapp_webhook(request: Request):
                                               "Please provide any missing information."
                         
                         
-                        save_message = chat_agent.save_message(chat_id, user_id, body, missing_info_message)
-                        execute_query(save_message["query"], save_message["params"])
-                        
-        
-                        response = twilio_client.messages.create(
-                            from_=TWILIO_WHATSAPP_NUMBER,
-                            body=missing_info_message,
-                            to=from_number
-                        )
+                        return await reply_and_log(chat_id, user_id, body, missing_info_message)
                     else:
                     
                         unknown_response_message = "I'm having trouble understanding your request. Please provide:\n\n" + \
@@ -410,41 +375,54 @@ async def whatsapp_webhook(request: Request):
                                                  "3. Your resume/CV/transcript/experience letter as an attachment"
                         
 
-                        save_message = chat_agent.save_message(chat_id, user_id, body, unknown_response_message)
-                        execute_query(save_message["query"], save_message["params"])
-                        
-                
-                        response = twilio_client.messages.create(
-                            from_=TWILIO_WHATSAPP_NUMBER,
-                            body=unknown_response_message,
-                            to=from_number
-                        )
+                        return await reply_and_log(chat_id, user_id, body, unknown_response_message)
             except Exception as e:
-                logger.error(f"Error processing message: {e}", exc_info=True)
-                response = twilio_client.messages.create(
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    body="Sorry, I encountered an error processing your request. Please try again later.",
-                    to=from_number
-                )
+                logger.error("Error processing message: %s", e, exc_info=True)
+                return "Sorry, I encountered an error processing your request. Please try again later."
         else:
-            logger.warning(f"Received message without WaId: {from_number}")
-            response = twilio_client.messages.create(
-                from_=TWILIO_WHATSAPP_NUMBER,
-                body="Sorry, I couldn't identify your phone number.",
-                to=from_number
-            )
+            logger.warning("Received message without WaId: %s", from_number)
+            return "Sorry, I couldn't identify your phone number."
+    except Exception as e:
+        logger.error("Error processing WhatsApp message: %s", e, exc_info=True)
 
-        return Response(
-            content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
-            media_type="application/xml"
-        )
+async def send_late_reply(task, to_number):
+    """Send the reply through the REST API once processing that outlived the webhook finishes"""
+    reply = await task
+    if reply:
+        await asyncio.to_thread(send_whatsapp_message, reply, to_number)
+        logger.info("Late reply sent")
+
+def twiml_reply(body=None):
+    """Build the TwiML webhook response, with a reply message when body is given"""
+    response = MessagingResponse()
+    if body:
+        response.message(body)
+    return response.to_xml()
+
+@app.post("/webhook/whatsapp")
+async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
+    """
+    Webhook endpoint for WhatsApp messages - Email Assistant System
+    """
+    print('Webhook hit')
+    try:
+        form_data = await request.form()
+        form_dict = dict(form_data)
+        logger.debug("Received WhatsApp webhook data: %s", form_dict)
         
+        # Reply in the webhook response when processing finishes in time; otherwise acknowledge
+        # Twilio before it times out and send the reply through the REST API afterwards
+        task = asyncio.create_task(process_whatsapp_message(form_dict))
+        try:
+            reply = await asyncio.wait_for(asyncio.shield(task), TWIML_REPLY_TIMEOUT)
+            return Response(content=twiml_reply(reply), media_type="application/xml")
+        except asyncio.TimeoutError:
+            logger.info("Processing is taking too long, the reply will be sent separately")
+            background_tasks.add_task(send_late_reply, task, form_dict.get("From", ""))
     except Exception as e:
-        logger.error(f"Error in WhatsApp webhook: {e}", exc_info=True)
-        return Response(
-            content="<?xml version='1.0' encoding='UTF-8'?><Response></Response>",
-            media_type="application/xml"
-        )
+        logger.error("Error in WhatsApp webhook: %s", e, exc_info=True)
+    
+    return Response(content=twiml_reply(), media_type="application/xml")
 
 if __name__ == "__main__":
     import uvicorn
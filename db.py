@@ -1,17 +1,34 @@
 import sqlite3
-import os
 from datetime import datetime
 import logging
-import re
+import threading
 
 DB_FILE = "email_assistant.db"
 
+# Only the most recent messages of a chat are needed to analyze the conversation
+CHAT_HISTORY_LIMIT = 10
+
+# One shared connection in autocommit mode; sqlite3 connections are not safe for
+# concurrent use, so every access goes through _LOCK
+_CONN = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+_CONN.row_factory = sqlite3.Row
+_LOCK = threading.Lock()
+
 def init_db():
     """Initialize the database with required tables"""
-    db_exists = os.path.exists(DB_FILE)
+    with _LOCK:
+        _init_db(_CONN.cursor())
+
+def _init_db(cursor):
+    """Apply connection pragmas, create the tables and seed the users table on a new database"""
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")
     
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    # The connection creates the file on import, so check for the users table instead
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+    db_exists = cursor.fetchone() is not None
     
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -49,6 +66,12 @@ def init_db():
     )
     ''')
     
+    # Indexes for the lookups made on every webhook; users.phone is UNIQUE, so its automatic index
+    # already serves the phone lookup
+    cursor.execute("DROP INDEX IF EXISTS idx_users_phone")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_status ON chats(user_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at)")
+    
     if not db_exists:
         cursor.execute('''
         INSERT INTO users (name, phone, email, is_member) VALUES 
@@ -56,74 +79,71 @@ def init_db():
         ('John Doe', '+12345678901', 'john@example.com', 1),
         ('Jane Smith', '+12345678902', 'jane@example.com', 0)
         ''')
-    
-    conn.commit()
-    conn.close()
 
-def execute_query(query, params=None, fetch=True):
-    """Execute an SQL query and return results if needed"""
+def _fetch(query, params):
+    """Run a prepared SELECT statement and return its rows as dicts"""
+    with _LOCK:
+        try:
+            return [dict(row) for row in _CONN.execute(query, params).fetchall()]
+        except Exception as e:
+            logging.error("Database error: %s", e)
+            raise
 
-    clean_query = query.strip()
-    if clean_query.startswith("```"):
-        # Remove SQL code block markers if present
-        clean_query = clean_query.split("\n", 1)[-1]  
-        if clean_query.endswith("```"):
-            clean_query = clean_query.rsplit("\n", 1)[0] 
-    
-    # Clean up the query
-    clean_query = clean_query.replace("`", "").strip().rstrip(';')
-    clean_query = clean_query.replace("NOW()", "CURRENT_TIMESTAMP")
-    clean_query = clean_query.replace("CURDATE()", "DATE('now')")
-    
-    # Log the cleaned query
-    logging.debug(f"Executing SQL query: {clean_query}")
-    
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row  
-    cursor = conn.cursor()
-    
-    try:
-        if params:
-            cursor.execute(clean_query, params)
-        else:
-            # For INSERT queries with text values, use parameterized queries
-            if clean_query.upper().startswith("INSERT"):
-                # Extract values from the query
-                match = re.search(r"VALUES\s*\((.*?)\)", clean_query, re.IGNORECASE | re.DOTALL)
-                if match:
-                    # Get the values part
-                    values = match.group(1)
-                    # Split into individual values
-                    value_list = [v.strip().strip("'") for v in values.split(",")]
-                    # Create parameterized query
-                    param_placeholders = ",".join(["?" for _ in value_list])
-                    param_query = re.sub(
-                        r"VALUES\s*\(.*?\)",
-                        f"VALUES ({param_placeholders})",
-                        clean_query,
-                        flags=re.IGNORECASE | re.DOTALL
-                    )
-                    cursor.execute(param_query, value_list)
-                else:
-                    cursor.execute(clean_query)
-            else:
-                cursor.execute(clean_query)
-        
-        if fetch:
-            if clean_query.strip().upper().startswith("SELECT"):
-                results = [dict(row) for row in cursor.fetchall()]
-                conn.close()
-                return results if results else []  # Return empty list instead of None
-            else:
-                conn.commit()
-                last_id = cursor.lastrowid
-                conn.close()
-                return {"id": last_id}
-        else:
-            conn.commit()
-            conn.close()
-            return {"success": True}
-    except Exception as e:
-        logging.error(f"Database error: {str(e)}")
-        conn.close()
-        raise e 
\ No newline at end of file
+def _write(query, params):
+    """Run a prepared INSERT/UPDATE statement and return the last inserted row id"""
+    with _LOCK:
+        try:
+            return _CONN.execute(query, params).lastrowid
+        except Exception as e:
+            logging.error("Database error: %s", e)
+            raise
+
+def get_user_by_phone(phone):
+    """Return the non-deleted user with the given phone number, or None"""
+    rows = _fetch(
+        "SELECT id, name, phone, is_member FROM users WHERE phone = ? AND is_deleted = 0",
+        (phone,)
+    )
+    return rows[0] if rows else None
+
+def get_active_chat(user_id):
+    """Return the user's most recent active chat, or None"""
+    rows = _fetch(
+        "SELECT id, user_id, status FROM chats WHERE user_id = ? AND status = 'active' "
+        "ORDER BY created_at DESC LIMIT 1",
+        (user_id,)
+    )
+    return rows[0] if rows else None
+
+def create_chat(user_id):
+    """Create a new active chat for the user and return its id"""
+    return _write(
+        "INSERT INTO chats (user_id, status, created_at, updated_at) "
+        "VALUES (?, 'active', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+        (user_id,)
+    )
+
+def end_chat(chat_id):
+    """Mark a chat as ended"""
+    _write(
+        "UPDATE chats SET status = 'ended', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (chat_id,)
+    )
+
+def save_message(chat_id, user_id, user_message, bot_reply):
+    """Store a user message and the bot's reply, returning the new message id"""
+    return _write(
+        "INSERT INTO messages (chat_id, user_id, user_message, bot_reply, created_at) "
+        "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        (chat_id, user_id, user_message, bot_reply)
+    )
+
+def get_chat_messages(chat_id, limit=CHAT_HISTORY_LIMIT):
+    """Return the last `limit` messages of a chat, oldest first"""
+    rows = _fetch(
+        "SELECT user_message, bot_reply, created_at FROM messages WHERE chat_id = ? "
+        "ORDER BY created_at DESC, id DESC LIMIT ?",
+        (chat_id, limit)
+    )
+    rows.reverse()
+    return rows
@@ -2,7 +2,58 @@ from phi.agent import Agent
 from phi.tools import Toolkit
 from phi.model.google import Gemini
 import os
-from typing import Optional, List
+import smtplib
+import threading
+from typing import Optional, List, Tuple, Union
+
+class _SmtpPool:
+    """Keeps one logged-in SMTP connection per sender and reuses it across emails"""
+
+    def __init__(self, host: str = "smtp.gmail.com", port: int = 465):
+        self.host = host
+        self.port = port
+        self._connections = {}
+        # SMTP connections are not thread-safe, so sends are serialized
+        self._lock = threading.Lock()
+
+    def _connect(self, sender_email: str, sender_passkey: str) -> smtplib.SMTP_SSL:
+        smtp = smtplib.SMTP_SSL(self.host, self.port)
+        try:
+            smtp.login(sender_email, sender_passkey)
+        except Exception:
+            self._close(smtp)
+            raise
+        self._connections[(sender_email, sender_passkey)] = smtp
+        return smtp
+
+    def _close(self, smtp: smtplib.SMTP_SSL) -> None:
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def send(self, msg, sender_email: str, sender_passkey: str) -> None:
+        """Sends a message, reconnecting if the cached connection has gone stale."""
+        key = (sender_email, sender_passkey)
+        with self._lock:
+            smtp = self._connections.get(key)
+            if smtp is not None:
+                try:
+                    if smtp.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected("NOOP failed")
+                except (smtplib.SMTPException, OSError):
+                    self._close(self._connections.pop(key))
+                    smtp = None
+            if smtp is None:
+                smtp = self._connect(sender_email, sender_passkey)
+            try:
+                smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._close(self._connections.pop(key))
+                smtp = self._connect(sender_email, sender_passkey)
+                smtp.send_message(msg)
+
+_smtp_pool = _SmtpPool()
 
 class EmailToolsWithAttachments(Toolkit):
     def __init__(
@@ -20,23 +71,24 @@ class EmailToolsWithAttachments(Toolkit):
         
         self.register(self.email_user_with_attachments)
     
-    def email_user_with_attachments(self, subject: str, body: str, attachments: Optional[List[str]] = None) -> str:
+    def email_user_with_attachments(self, subject: str, body: str, attachments: Optional[List[Union[str, Tuple[str, bytes]]]] = None, receiver_email: Optional[str] = None) -> str:
         """Emails the user with the given subject, body, and optional attachments.
 
         :param subject: The subject of the email.
         :param body: The body of the email.
-        :param attachments: List of file paths to attach to the email.
+        :param attachments: List of file paths or (file name, file data) pairs to attach to the email.
+        :param receiver_email: Recipient address, defaults to the toolkit's receiver_email.
         :return: "success" if the email was sent successfully, "error: [error message]" otherwise.
         """
         try:
-            import smtplib
             from email.message import EmailMessage
             import mimetypes
         except ImportError:
             print("Required libraries not installed")
             return "error: Required libraries not installed"
 
-        if not self.receiver_email:
+        receiver_email = receiver_email or self.receiver_email
+        if not receiver_email:
             return "error: No receiver email provided"
         if not self.sender_name:
             return "error: No sender name provided"
@@ -48,35 +100,37 @@ class EmailToolsWithAttachments(Toolkit):
         msg = EmailMessage()
         msg["Subject"] = subject
         msg["From"] = f"{self.sender_name} <{self.sender_email}>"
-        msg["To"] = self.receiver_email
+        msg["To"] = receiver_email
         msg.set_content(body)
 
         if attachments:
-            for file_path in attachments:
+            for attachment in attachments:
+                # In-memory attachments are (file name, file data) pairs, anything else is a path on disk
+                in_memory = isinstance(attachment, tuple)
+                file_name = attachment[0] if in_memory else os.path.basename(attachment)
                 try:
-                    with open(file_path, 'rb') as f:
-                        file_data = f.read()
-                        file_name = os.path.basename(file_path)
-                        
-        
-                        content_type, encoding = mimetypes.guess_type(file_path)
-                        if content_type is None or encoding is not None:
-                            content_type = 'application/octet-stream'
-                        
-                        maintype, subtype = content_type.split('/', 1)
-                        msg.add_attachment(file_data, 
-                                          maintype=maintype, 
-                                          subtype=subtype, 
-                                          filename=file_name)
+                    if in_memory:
+                        file_data = attachment[1]
+                    else:
+                        with open(attachment, 'rb') as f:
+                            file_data = f.read()
+                    
+                    content_type, encoding = mimetypes.guess_type(file_name)
+                    if content_type is None or encoding is not None:
+                        content_type = 'application/octet-stream'
+                    
+                    maintype, subtype = content_type.split('/', 1)
+                    msg.add_attachment(file_data, 
+                                      maintype=maintype, 
+                                      subtype=subtype, 
+                                      filename=file_name)
                 except Exception as e:
-                    print(f"Failed to attach file {file_path}: {e}")
-                    return f"error: Failed to attach file {file_path}: {e}"
+                    print(f"Failed to attach file {file_name}: {e}")
+                    return f"error: Failed to attach file {file_name}: {e}"
 
-        print(f"Sending Email to {self.receiver_email} with {len(attachments) if attachments else 0} attachments")
+        print(f"Sending Email to {receiver_email} with {len(attachments) if attachments else 0} attachments")
         try:
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-                smtp.login(self.sender_email, self.sender_passkey)
-                smtp.send_message(msg)
+            _smtp_pool.send(msg, self.sender_email, self.sender_passkey)
         except Exception as e:
             print(f"Error sending email: {e}")
             return f"error: {e}"
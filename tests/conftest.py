@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing the app creates its SQLite database and Chroma store in the working directory,
+# so run from a scratch directory instead of the checkout
+os.chdir(tempfile.mkdtemp(prefix="zmail-tests-"))
+
+# The app reads its API credentials on import; the tests never reach the real services
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACtest")
+os.environ.setdefault("TWILIO_AUTH_TOKEN", "test-token")
@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def user(tmp_path, monkeypatch):
+    """Point db at a fresh temp-file database and return a seeded member"""
+    conn = sqlite3.connect(tmp_path / "test.db", check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    monkeypatch.setattr(db, "_CONN", conn)
+    db.init_db()
+    yield db.get_user_by_phone("+12345678901")
+    conn.close()
+
+
+def test_get_chat_messages_returns_the_last_messages_oldest_first(user):
+    chat_id = db.create_chat(user["id"])
+    for i in range(db.CHAT_HISTORY_LIMIT + 5):
+        db.save_message(chat_id, user["id"], f"message {i}", f"reply {i}")
+
+    messages = db.get_chat_messages(chat_id)
+
+    assert [m["user_message"] for m in messages] == [f"message {i}" for i in range(5, db.CHAT_HISTORY_LIMIT + 5)]
+    assert messages[-1]["bot_reply"] == f"reply {db.CHAT_HISTORY_LIMIT + 4}"
+
+
+def test_get_chat_messages_with_a_custom_limit(user):
+    chat_id = db.create_chat(user["id"])
+    for i in range(5):
+        db.save_message(chat_id, user["id"], f"message {i}", f"reply {i}")
+
+    assert [m["user_message"] for m in db.get_chat_messages(chat_id, limit=2)] == ["message 3", "message 4"]
+
+
+def test_get_chat_messages_only_reads_the_given_chat(user):
+    first = db.create_chat(user["id"])
+    second = db.create_chat(user["id"])
+    db.save_message(first, user["id"], "first chat", "reply")
+    db.save_message(second, user["id"], "second chat", "reply")
+
+    assert [m["user_message"] for m in db.get_chat_messages(first)] == ["first chat"]
+    assert db.get_chat_messages(db.create_chat(user["id"])) == []
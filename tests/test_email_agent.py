@@ -0,0 +1,101 @@
+import smtplib
+
+import pytest
+
+pytest.importorskip("phi")
+
+from email_agent import _SmtpPool
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP_SSL and records what happens to each connection"""
+
+    opened = []
+    fail_login = False
+
+    def __init__(self, host, port):
+        self.logins = 0
+        self.sent = []
+        self.closed = False
+        self.noop_code = 250
+        self.disconnect_on_send = False
+        FakeSMTP.opened.append(self)
+
+    def login(self, user, password):
+        if FakeSMTP.fail_login:
+            raise smtplib.SMTPAuthenticationError(535, b"Username and Password not accepted")
+        self.logins += 1
+
+    def noop(self):
+        if self.noop_code is None:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return self.noop_code, b"OK"
+
+    def send_message(self, msg):
+        if self.disconnect_on_send:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.append(msg)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(smtplib, "SMTP_SSL", FakeSMTP)
+    monkeypatch.setattr(FakeSMTP, "opened", [])
+    monkeypatch.setattr(FakeSMTP, "fail_login", False)
+    return _SmtpPool()
+
+
+def send(pool, msg):
+    pool.send(msg, "sender@example.com", "passkey")
+
+
+def test_connection_is_reused_across_emails(pool):
+    send(pool, "first")
+    send(pool, "second")
+
+    assert len(FakeSMTP.opened) == 1
+    assert FakeSMTP.opened[0].logins == 1
+    assert FakeSMTP.opened[0].sent == ["first", "second"]
+
+
+@pytest.mark.parametrize("noop_code", [421, None])
+def test_reconnects_when_noop_fails(pool, noop_code):
+    send(pool, "first")
+    FakeSMTP.opened[0].noop_code = noop_code
+
+    send(pool, "second")
+
+    stale, fresh = FakeSMTP.opened
+    assert stale.closed
+    assert fresh.sent == ["second"]
+
+
+def test_reconnects_when_the_server_disconnects_during_send(pool):
+    send(pool, "first")
+    FakeSMTP.opened[0].disconnect_on_send = True
+
+    send(pool, "second")
+
+    stale, fresh = FakeSMTP.opened
+    assert stale.closed
+    assert stale.sent == ["first"]
+    assert fresh.sent == ["second"]
+
+
+def test_socket_is_closed_when_login_fails(pool):
+    FakeSMTP.fail_login = True
+
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        send(pool, "first")
+
+    assert FakeSMTP.opened[0].closed
+
+    FakeSMTP.fail_login = False
+    send(pool, "second")
+    assert FakeSMTP.opened[1].sent == ["second"]
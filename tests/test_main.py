@@ -0,0 +1,164 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+for module in ("fastapi", "twilio", "httpx", "phi", "chromadb", "pymupdf"):
+    pytest.importorskip(module)
+
+import Main
+
+SUBJECT = "Python Developer"
+RESUME = ("resume.pdf", b"%PDF-1.4 resume")
+
+
+class FakeSummaryAgent:
+    """Returns a canned email body and counts how often it is asked"""
+
+    def __init__(self, content):
+        self.content = content
+        self.calls = 0
+
+    def generate_email_content(self, resume_chunks, job_subject, recipient_email=None):
+        self.calls += 1
+        return self.content
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(Main, "_PDF_CACHE", OrderedDict())
+    monkeypatch.setattr(Main, "_EMAIL_BODY_CACHE", OrderedDict())
+    monkeypatch.setattr(Main, "PDF_CACHE_SIZE", 2)
+
+
+class FakeExtractor:
+    """Stands in for extract_resume_chunks and records the PDF hashes it is given"""
+
+    def __init__(self):
+        self.chunks = ["Resume text"]
+        self.calls = []
+
+    async def __call__(self, subject, pdf_data, pdf_hash):
+        self.calls.append(pdf_hash)
+        return self.chunks
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    fake = FakeExtractor()
+    monkeypatch.setattr(Main, "extract_resume_chunks", fake)
+    return fake
+
+
+def use_summary(monkeypatch, content):
+    agent = FakeSummaryAgent(content)
+    monkeypatch.setattr(Main, "summary_agent", agent)
+    return agent
+
+
+def generate(attachment=RESUME, recipient="hr@acme.com"):
+    return asyncio.run(Main.generate_email_body(SUBJECT, attachment, recipient))
+
+
+def test_cache_evicts_the_least_recently_used_entry(caches):
+    cache = Main._PDF_CACHE
+    Main._cache_put(cache, "a", 1)
+    Main._cache_put(cache, "b", 2)
+    assert Main._cache_get(cache, "a") == 1
+
+    Main._cache_put(cache, "c", 3)
+
+    assert list(cache) == ["a", "c"]
+
+
+def test_cache_miss_stores_nothing(caches):
+    assert Main._cache_get(Main._PDF_CACHE, "missing") is None
+    assert "missing" not in Main._PDF_CACHE
+
+
+def test_email_body_is_generated_once_per_pdf_subject_and_recipient(caches, extractor, monkeypatch):
+    summary = use_summary(monkeypatch, "Dear Hiring Manager, ...")
+
+    assert generate() == generate() == "Dear Hiring Manager, ..."
+    assert summary.calls == 1
+    assert len(extractor.calls) == 1
+
+    generate(recipient="jobs@other.com")
+    assert summary.calls == 2
+    assert len(extractor.calls) == 1
+
+
+def test_failed_generation_falls_back_to_the_template_without_caching(caches, extractor, monkeypatch):
+    summary = use_summary(monkeypatch, None)
+
+    assert generate() == Main.get_default_email_template(SUBJECT)
+    assert Main._EMAIL_BODY_CACHE == {}
+
+    generate()
+    assert summary.calls == 2
+    assert len(extractor.calls) == 1
+
+
+def test_failed_extraction_is_not_cached(caches, extractor, monkeypatch):
+    use_summary(monkeypatch, "Dear Hiring Manager, ...")
+    extractor.chunks = None
+
+    assert generate() == Main.get_default_email_template(SUBJECT)
+    assert Main._PDF_CACHE == {}
+    assert Main._EMAIL_BODY_CACHE == {}
+
+
+class FakeRequest:
+    """Minimal stand-in for the Twilio webhook request"""
+
+    def __init__(self, form):
+        self._form = form
+
+    async def form(self):
+        return self._form
+
+
+def call_webhook(monkeypatch, reply, delay=0.0, timeout=1.0):
+    """Run the webhook with a stubbed message handler; returns the TwiML and the REST sends before/after background tasks"""
+    sent = []
+
+    async def process_whatsapp_message(form_dict):
+        await asyncio.sleep(delay)
+        return reply
+
+    monkeypatch.setattr(Main, "process_whatsapp_message", process_whatsapp_message)
+    monkeypatch.setattr(Main, "send_whatsapp_message", lambda body, to_number: sent.append((body, to_number)))
+    monkeypatch.setattr(Main, "TWIML_REPLY_TIMEOUT", timeout)
+
+    async def scenario():
+        background_tasks = Main.BackgroundTasks()
+        request = FakeRequest({"From": "whatsapp:+12345678901", "Body": "hi"})
+        response = await Main.whatsapp_webhook(request, background_tasks)
+        sent_with_response = list(sent)
+        await background_tasks()
+        return response, sent_with_response
+
+    response, sent_with_response = asyncio.run(scenario())
+    return response.body.decode(), sent_with_response, sent
+
+
+def test_fast_reply_is_returned_as_twiml(monkeypatch):
+    twiml, sent_with_response, sent = call_webhook(monkeypatch, "Hello <Test> & welcome")
+
+    assert "<Message>Hello &lt;Test&gt; &amp; welcome</Message>" in twiml
+    assert sent == []
+
+
+def test_no_reply_returns_empty_twiml(monkeypatch):
+    twiml, _, sent = call_webhook(monkeypatch, None)
+
+    assert "<Message>" not in twiml
+    assert sent == []
+
+
+def test_slow_reply_is_sent_through_the_rest_api_after_the_webhook_returns(monkeypatch):
+    twiml, sent_with_response, sent = call_webhook(monkeypatch, "Late hello", delay=0.05, timeout=0.01)
+
+    assert "<Message>" not in twiml
+    assert sent_with_response == []
+    assert sent == [("Late hello", "whatsapp:+12345678901")]
@@ -0,0 +1,95 @@
+import pytest
+
+pytest.importorskip("phi")
+pytest.importorskip("chromadb")
+
+from Agentic_System import _find_email, _find_subject, mediator_agent
+
+PDF_URL = "https://api.twilio.com/media/resume"
+
+
+@pytest.mark.parametrize("text, subject", [
+    ("Subject: Python Developer", "Python Developer"),
+    ("subject is: Python Developer", "Python Developer"),
+    ("Subject: Application for John's team", "Application for John's team"),
+    ("subject: Backend Engineer role email hr@acme.com", "Backend Engineer role"),
+    ("send it to hr@acme.com with subject: Data Analyst.", "Data Analyst"),
+    ("Subject - 'ML Engineer', thanks", "ML Engineer"),
+    ('subject="SWE Intern"', "SWE Intern"),
+    ("Subject line: Python 3.11 Developer\nthanks", "Python 3.11 Developer"),
+    ("subject: Application for Sr. Engineer role", "Application for Sr. Engineer role"),
+    ("Subject: Jr. Developer at Acme", "Jr. Developer at Acme"),
+    ("Subject: Backend Engineer at Acme Inc. to hr@acme.com", "Backend Engineer at Acme Inc."),
+    ("subject: Data Analyst (e.g. SQL and dashboards)", "Data Analyst (e.g. SQL and dashboards)"),
+    ("Subject: 'Sr. Engineer'. Thanks!", "Sr. Engineer"),
+    ("Subject: Data Analyst. Thanks!", "Data Analyst"),
+    ("Subject: Python Developer! please", "Python Developer! please"),
+    ("the subject is missing, sorry", None),
+    ("what subject is best", None),
+    ("I'm a subject-matter expert", None),
+    ("hello", None),
+])
+def test_find_subject(text, subject):
+    assert _find_subject(text) == subject
+
+
+@pytest.mark.parametrize("text, email", [
+    ("send to hr@acme.com", "hr@acme.com"),
+    ("email: jane.doe+jobs@mail.example.co.uk.", "jane.doe+jobs@mail.example.co.uk"),
+    ("recipient is hr@acme.com, subject: x", "hr@acme.com"),
+    ("no address here", None),
+])
+def test_find_email(text, email):
+    assert _find_email(text) == email
+
+
+@pytest.fixture
+def agent_reply(monkeypatch):
+    """Replace the LLM fallback with a canned reply and record its calls"""
+    calls = []
+
+    def ask_agent(user_data, chat_history, user_message, media_urls):
+        calls.append(user_message)
+        return "FALSE_2"
+
+    monkeypatch.setattr(mediator_agent, "_ask_agent", ask_agent)
+    return calls
+
+
+def analyze(message, history=(), media_urls=()):
+    return mediator_agent.analyze_conversation({"name": "Test"}, list(history), message, list(media_urls))
+
+
+def test_complete_request_with_attachment(agent_reply):
+    result = analyze("Send to hr@acme.com, subject: Python Developer", media_urls=[PDF_URL])
+    assert result == f"TRUE, hr@acme.com, Python Developer, {PDF_URL}"
+    assert agent_reply == []
+
+
+def test_complete_request_without_attachment(agent_reply):
+    assert analyze("Send to hr@acme.com, subject: Python Developer") == "FALSE_1"
+
+
+def test_missing_email(agent_reply):
+    assert analyze("subject: Python Developer", media_urls=[PDF_URL]) == "FALSE_2"
+    assert agent_reply == []
+
+
+def test_details_are_collected_from_earlier_user_messages(agent_reply):
+    history = [
+        {"user_message": "The recipient is hr@acme.com", "bot_reply": "e.g. recruiter@company.com"},
+        {"user_message": "Subject: Data Analyst", "bot_reply": "Please attach your resume"},
+    ]
+    result = analyze("here it is", history, [PDF_URL])
+    assert result == f"TRUE, hr@acme.com, Data Analyst, {PDF_URL}"
+
+
+def test_bot_replies_are_not_scanned(agent_reply):
+    history = [{"user_message": "hi", "bot_reply": "Send me the address, e.g. recruiter@company.com"}]
+    assert analyze("subject: Data Analyst", history, [PDF_URL]) == "FALSE_2"
+
+
+def test_unmarked_subject_goes_to_the_llm(agent_reply):
+    history = [{"user_message": "send to hr@acme.com", "bot_reply": "What is the subject?"}]
+    assert analyze("the subject is missing, sorry", history, [PDF_URL]) == "FALSE_2"
+    assert agent_reply == ["the subject is missing, sorry"]
@@ -0,0 +1,70 @@
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+pytest.importorskip("phi")
+pytest.importorskip("chromadb")
+
+from Agentic_System import pdf_agent
+
+
+class FakeCollection:
+    """Records upserts instead of embedding and storing them"""
+
+    def __init__(self):
+        self.upserts = []
+
+    def upsert(self, documents, ids, metadatas):
+        self.upserts.append({"documents": documents, "ids": ids, "metadatas": metadatas})
+
+
+def make_pdf(text):
+    with pymupdf.open() as doc:
+        doc.new_page().insert_text((72, 72), text)
+        return doc.tobytes()
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    fake = FakeCollection()
+    monkeypatch.setattr(pdf_agent, "collection", fake)
+    return fake
+
+
+def test_process_pdf_reads_file_from_disk(tmp_path, collection):
+    path = tmp_path / "resume.pdf"
+    path.write_bytes(make_pdf("Python developer"))
+
+    result = pdf_agent.process_pdf(str(path))
+
+    assert result["status"] == "success"
+    assert result["filename"] == "resume.pdf"
+    assert collection.upserts[0]["ids"] == ["resume.pdf"]
+    assert "Python developer" in collection.upserts[0]["documents"][0]
+
+
+def test_process_pdf_bytes_reads_pdf_from_memory(collection):
+    result = pdf_agent.process_pdf_bytes(make_pdf("Backend engineer"), "abc123")
+
+    assert result["status"] == "success"
+    assert result["filename"] == "abc123"
+    assert collection.upserts[0]["metadatas"] == [{"filename": "abc123"}]
+    assert "Backend engineer" in collection.upserts[0]["documents"][0]
+
+
+def test_process_pdf_reports_unreadable_files(tmp_path, collection):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf")
+
+    assert pdf_agent.process_pdf(str(path))["status"] == "error"
+    assert collection.upserts == []
+
+
+def test_process_pdf_rejects_pdfs_without_text(collection):
+    with pymupdf.open() as doc:
+        doc.new_page()
+        blank = doc.tobytes()
+
+    result = pdf_agent.process_pdf_bytes(blank, "blank")
+
+    assert result["status"] == "error"
+    assert collection.upserts == []